@@ -10,30 +10,47 @@ from utils.shutdown import reset_shutdown_timer
 BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
 
-async def main():
+async def post_init(app):
+    # start initial shutdown timer (async, runs inside the polling loop)
+    await reset_shutdown_timer()
+
+
+def build_app():
     if not BOT_TOKEN:
         print("❌ TELEGRAM_TOKEN tidak ditemukan di Secret!")
         sys.exit(1)
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
 
     # registrasi fitur (link generator)
     register_handlers(app)
 
     print("🤖 Bot aktif! Siap menerima perintah di Telegram.")
+    return app
 
-    # start initial shutdown timer (async)
-    await reset_shutdown_timer()
 
-    # run polling (await)
-    await app.run_polling()
+def _loop_running():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
 
 
 if __name__ == "__main__":
-    # Compatibility with hosted runners that may already run an event loop
-    try:
+    nested = _loop_running()
+    if nested:
+        # Compatibility with hosted runners that already run an event loop:
+        # nest_asyncio lets run_polling drive that loop (it can't patch uvloop loops)
         import nest_asyncio
         nest_asyncio.apply()
-        asyncio.get_event_loop().run_until_complete(main())
-    except ModuleNotFoundError:
-        asyncio.run(main())
\ No newline at end of file
+    else:
+        # uvloop (faster socket I/O) if installed; run_polling uses the current event loop
+        try:
+            import uvloop
+            asyncio.set_event_loop(uvloop.new_event_loop())
+        except ModuleNotFoundError:
+            pass
+
+    # run polling (blocking); don't close a loop that belongs to the host
+    build_app().run_polling(close_loop=not nested)
\ No newline at end of file
@@ -1,9 +1,11 @@
 # features/link_cmd.py
 import re
 import asyncio
+import functools
 import itertools
+import math
 from urllib.parse import quote
-import aiohttp
+import httpx
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     CallbackQueryHandler,
@@ -16,10 +18,16 @@ from telegram.ext import (
 # =========================
 # CONFIG
 # =========================
-WORKERS = 4
-BATCH_SIZE = 2000
-SLEEP_PER_BATCH = 1.5  # detik antar batch
+WORKERS = 64  # worker yang mengambil url dari antrian (work-stealing)
+QUEUE_SIZE = 512  # antrian url yang sudah di generate tapi belum dicek
+PROGRESS_INTERVAL = 1.0  # detik minimal antar edit pesan progress
+HTTP_MAX_CONNECTIONS = WORKERS  # koneksi di pool; dengan HTTP/2 banyak request berbagi satu koneksi
+HTTP_TIMEOUT = 4  # detik
+RETRY_ATTEMPTS = 3  # retry per url kalau server balas 429/503
+RETRY_BASE_DELAY = 0.25  # detik, dikali 2 tiap retry
+RETRY_MAX_DELAY = 4.0  # detik
 MAX_COMBINATIONS = 20000  # batas kombinasi supaya aman
+GACHA_MAX_SUFFIX = 6  # nama gacha dicoba tanpa suffix dan -2..-6
 
 # Conversation state
 ASKING_TAGS = 1
@@ -35,45 +43,40 @@ OVERVIEW_VARIANTS = ["overview", "viewover", "overivew", "rivervow", "vowover"]
 # =========================
 # Utilities
 # =========================
-_tag_re = re.compile(r'\[([A-Za-z0-9]+)\]')
+# progress bar, sliced instead of rebuilt on every update
+_BAR_LEN = 15
+_BAR_FULL = "█" * _BAR_LEN
+_BAR_EMPTY = "░" * _BAR_LEN
+
+# chars left as-is when encoding a template: URL reserved chars, [ ] for tags, % for escapes
+_TEMPLATE_SAFE = ":/?#[]@!$&'()*+,;=%"
+
+# only alphanumeric names match, so every extracted tag is already valid
+_tag_re = re.compile(r'\[([A-Za-z0-9]+)\]', re.ASCII)
+
+@functools.lru_cache(maxsize=4096)
+def _quote_value(value: str) -> str:
+    """URL-encode a tag value (cached: banner splash/overview and repeated runs reuse the same values)."""
+    return quote(value, safe='')
 
 def extract_tags(template: str):
     return _tag_re.findall(template)
 
-def valid_tags(tags):
-    return all(re.fullmatch(r'[A-Za-z0-9]+', t) for t in tags)
-
 def expand_gacha_name_base(name: str):
     """
     Expand a single gacha name into case variants.
     Returns unique list (preserve original).
     Also tries to include a camel-ish TokenWheel if name contains 'token' and 'wheel'.
     """
-    variants = []
-    orig = name
-    if orig not in variants:
-        variants.append(orig)
-    title = orig.title()
-    if title not in variants:
-        variants.append(title)
-    lower = orig.lower()
-    if lower not in variants:
-        variants.append(lower)
+    lower = name.lower()
+    variants = [name, name.title(), lower]
     # special-case to include TokenWheel style if base contains token & wheel
     if "token" in lower and "wheel" in lower:
         # build "TokenWheel" style: capitalize tokens and concat
         parts = re.split(r'[\s_-]+', lower)
-        camel = "".join(p.capitalize() for p in parts)
-        if camel not in variants:
-            variants.append(camel)
-    # keep order, unique
-    seen = set()
-    uniq = []
-    for v in variants:
-        if v not in seen:
-            seen.add(v)
-            uniq.append(v)
-    return uniq
+        variants.append("".join(p.capitalize() for p in parts))
+    # keep order, unique (title/lower often equal the original)
+    return list(dict.fromkeys(variants))
 
 def expand_gacha_values(values_list):
     """
@@ -87,7 +90,7 @@ def expand_gacha_values(values_list):
         for b in bases:
             # variant 1 is the base without suffix
             out.append(b)
-            for i in range(2, 7):  # 2..6 inclusive
+            for i in range(2, GACHA_MAX_SUFFIX + 1):  # 2..6 inclusive
                 out.append(f"{b}-{i}")
     # dedupe preserving order
     seen = set()
@@ -101,122 +104,158 @@ def expand_gacha_values(values_list):
 # =========================
 # URL checking + worker
 # =========================
-async def check_url(session: aiohttp.ClientSession, url: str) -> bool:
-    """Try HEAD first, fallback to GET. Return True if status==200."""
+def _retry_delay(retry_after, attempt: int) -> float:
+    """
+    Seconds to wait before retry: server's Retry-After (in seconds) if it is a finite,
+    non-negative number, else exponential.
+    """
     try:
-        async with session.head(url, timeout=aiohttp.ClientTimeout(total=8)) as r:
-            if r.status == 200:
-                return True
-    except:
-        pass
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = None
+    # float() accepts "nan"/"inf"; asyncio.sleep(nan) never returns
+    if delay is None or not math.isfinite(delay) or delay < 0:
+        delay = RETRY_BASE_DELAY * 2 ** attempt
+    return min(delay, RETRY_MAX_DELAY)
+
+async def check_url(client: httpx.AsyncClient, url: str) -> bool:
+    """
+    HEAD the url, return True if status==200.
+    Fallback to GET only when the server rejects HEAD (405/501).
+    On 429/503 back off and retry this url only, up to RETRY_ATTEMPTS times.
+    """
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        try:
+            r = await client.head(url, follow_redirects=True)
+            status, retry_after = r.status_code, r.headers.get("Retry-After")
+            if status in (405, 501):
+                # stream so the body is never downloaded
+                async with client.stream("GET", url, timeout=10) as r:
+                    status, retry_after = r.status_code, r.headers.get("Retry-After")
+        except (httpx.HTTPError, httpx.InvalidURL):
+            return False
+        if status not in (429, 503):
+            return status == 200
+        if attempt < RETRY_ATTEMPTS:
+            await asyncio.sleep(_retry_delay(retry_after, attempt))
+    return False
+
+class _Found(Exception):
+    """Raised by the worker that found a live url; makes the TaskGroup cancel the other workers."""
+    def __init__(self, url: str):
+        super().__init__(url)
+        self.url = url
+
+def progress_text(count: int, total: int) -> str:
+    """Minimalist progress message: bar + percent + count."""
+    percent = count * 100 // total
+    filled = _BAR_LEN * percent // 100
+    return f"Progress: [{_BAR_FULL[:filled]}{_BAR_EMPTY[filled:]}] {percent}% ({count}/{total})"
+
+async def _edit_text(msg, text):
+    """Edit a Telegram message, ignoring errors (flood limit, message not modified, ...)."""
     try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as r:
-            return r.status == 200
-    except:
-        return False
+        await msg.edit_text(text)
+    except Exception:
+        pass
 
-async def worker_task(session, urls_chunk, progress, total, progress_msg, found_event):
+async def worker_task(client, queue, progress, progress_msg):
     """
-    Check batches inside this worker. Return first found URL or None.
-    progress: single-element list used as mutable counter
-    found_event: asyncio.Event to notify other workers
+    Pull urls from the shared queue and check them one by one until the None sentinel.
+    Raise _Found on the first live url, return None if the queue ran out.
+    progress: shared dict {'count', 'total', 'last_edit', 'last_pct', 'edit'} (see find_first_live_url)
     """
-    for i in range(0, len(urls_chunk), BATCH_SIZE):
-        if found_event.is_set():
+    while True:
+        url = await queue.get()
+        if url is None:
             return None
-        batch = urls_chunk[i:i+BATCH_SIZE]
-        # check batch in parallel
-        coros = [check_url(session, u) for u in batch]
-        results = await asyncio.gather(*coros, return_exceptions=True)
-
-        # update progress
-        progress[0] += len(batch)
-        # update progress message (minimalist)
-        percent = int(progress[0] / total * 100)
-        bar_len = 15
-        filled = int(bar_len * percent / 100)
-        bar = "█" * filled + "░" * (bar_len - filled)
-        try:
-            await progress_msg.edit_text(f"Progress: [{bar}] {percent}% ({progress[0]}/{total})")
-        except Exception:
-            pass
-
-        for idx, ok in enumerate(results):
-            if isinstance(ok, Exception):
-                continue
-            if ok:
-                found_url = batch[idx]
-                # notify others
-                found_event.set()
-                try:
-                    await progress_msg.edit_text(f"✅ Anjay Ketemu, GG Juga Lu🗿: {found_url}")
-                except Exception:
-                    pass
-                return found_url
-
-        # sleep between batches to avoid flooding target
-        await asyncio.sleep(SLEEP_PER_BATCH)
-    return None
-
-async def find_first_live_url(urls, progress_msg):
+        ok = await check_url(client, url)
+        if ok:
+            raise _Found(url)
+
+        # update progress; edit message at most once per PROGRESS_INTERVAL and only when
+        # percent changed. The edit runs in the background so checking doesn't wait on Telegram.
+        progress['count'] += 1
+        percent = progress['count'] * 100 // progress['total']
+        now = asyncio.get_running_loop().time()
+        edit = progress['edit']
+        if (percent != progress['last_pct'] and now - progress['last_edit'] > PROGRESS_INTERVAL
+                and (edit is None or edit.done())):
+            progress['last_pct'] = percent
+            progress['last_edit'] = now
+            progress['edit'] = asyncio.create_task(
+                _edit_text(progress_msg, progress_text(progress['count'], progress['total'])))
+
+async def producer_task(urls, queue, progress):
+    """
+    Feed urls into the queue as workers free up, then one None sentinel per worker.
+    Once urls is exhausted the real count is known: store it in progress['total']
+    (the announced total is an upper bound when colliding urls were skipped).
+    """
+    produced = 0
+    for url in urls:
+        await queue.put(url)
+        produced += 1
+    progress['total'] = produced
+    for _ in range(WORKERS):
+        await queue.put(None)
+
+def get_http_client(application) -> httpx.AsyncClient:
+    """
+    Return the AsyncClient shared by every /cmdlink run, creating it on first use.
+    HTTP/2 lets the CDN multiplex many HEADs over one TLS connection; keep-alive
+    connections are reused across checks instead of paying a new handshake each time.
     """
-    Distribute urls across WORKERS, run worker_task, return first found url or None.
-    Uses FIRST_COMPLETED loop to stop early.
+    client = application.bot_data.get('http')
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT),
+        )
+        application.bot_data['http'] = client
+    return client
+
+async def close_http_client(application):
+    """post_shutdown callback: close the shared AsyncClient if it was created."""
+    client = application.bot_data.pop('http', None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+async def find_first_live_url(client, urls, total, progress_msg):
+    """
+    Stream urls (any iterable, consumed lazily) through a queue to WORKERS workers,
+    return first found url or None.
+    total: number of urls for the progress message; may be an upper bound
+    (see _iter_urls), corrected by the producer once every url is generated.
+    Workers run in a TaskGroup: the first _Found cancels the producer and every other worker.
     """
-    total = len(urls)
     if total == 0:
         return None
 
-    # split urls into roughly equal chunks for workers (round-robin)
-    chunks = [urls[i::WORKERS] for i in range(WORKERS)]
-    progress = [0]
-    found_event = asyncio.Event()
-
-    async with aiohttp.ClientSession() as session:
-        tasks = [asyncio.create_task(worker_task(session, chunk, progress, total, progress_msg, found_event))
-                 for chunk in chunks if chunk]
-        if not tasks:
-            return None
-
-        pending = set(tasks)
-        found = None
-        try:
-            while pending:
-                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-                for d in done:
-                    try:
-                        res = d.result()
-                    except asyncio.CancelledError:
-                        res = None
-                    except Exception:
-                        res = None
-                    if res:
-                        found = res
-                        # cancel pending tasks
-                        for p in pending:
-                            p.cancel()
-                        # wait for cancellation finish
-                        await asyncio.gather(*pending, return_exceptions=True)
-                        pending = set()
-                        break
-                # if found, break outer loop
-                if found:
-                    break
-            # if no one found, ensure all tasks finished
-            if not found:
-                # gather remaining done results to be thorough
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                for r in results:
-                    if isinstance(r, str) and r:
-                        found = r
-                        break
-        finally:
-            # ensure all tasks cancelled/finished
-            for t in tasks:
-                if not t.done():
-                    t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    # count: urls checked, total: see docstring,
+    # last_edit/last_pct: last progress edit, edit: in-flight edit task
+    progress = {'count': 0, 'total': total, 'last_edit': 0.0, 'last_pct': -1, 'edit': None}
 
+    found = None
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(producer_task(urls, queue, progress))
+            for _ in range(WORKERS):
+                tg.create_task(worker_task(client, queue, progress, progress_msg))
+    except* _Found as eg:
+        found = eg.exceptions[0].url
+
+    # let the last progress edit land before the final text replaces it
+    if progress['edit'] is not None:
+        await progress['edit']
+    if found:
+        await _edit_text(progress_msg, f"✅ Anjay Ketemu, GG Juga Lu🗿: {found}")
     return found
 
 # =========================
@@ -226,44 +265,53 @@ def generate_urls_from_template(template: str, tag_values: dict):
     """
     template: string with tags like [V], [G], [E], [T], etc.
     tag_values: dict mapping tag -> list of user-supplied strings
-    returns list of URLs or raises ValueError if too many combinations or invalid input
+    returns (total, urls) where urls is a lazy iterator, so checking can start before
+    every url is built; raises ValueError if too many combinations.
+    total counts combinations: an upper bound if adjacent tags collide (see _iter_urls)
     """
-    tags = extract_tags(template)
+    # unique tags, in order (a tag used twice gets the same value in both places)
+    tags = list(dict.fromkeys(extract_tags(template)))
     if not tags:
-        return []
-
-    # prepare values per tag, with special handling for G (gacha)
-    lists = []
+        return 0, iter(())
+    raw_lists = []
     for t in tags:
         vals = tag_values.get(t, [])
         if not vals:
-            return []
-        # special expand for G (gacha)
-        if t.upper() == "G":
-            expanded = expand_gacha_values(vals)
-            lists.append(expanded)
-        elif t.upper() == "T" and all(v.isdigit() for v in vals):
-            # date-like sometimes numeric; keep as-is
-            lists.append(vals)
-        else:
-            # normal: use raw user values
-            lists.append(vals)
-
-    # calculate total combos
-    total = 1
-    for l in lists:
-        total *= len(l)
-        if total > MAX_COMBINATIONS:
-            raise ValueError(f"Jumlah kombinasi ({total}) terlalu besar. Kurangi jumlah nilai per tag.")
-
-    urls = []
-    for combo in itertools.product(*lists):
-        url = template
-        for i, t in enumerate(tags):
-            # URL-encode each value (preserve safe chars)
-            url = url.replace(f'[{t}]', quote(str(combo[i]), safe=''))
-        urls.append(url)
-    return urls
+            return 0, iter(())
+        # drop repeated user values ("1,1") so they don't multiply the combinations
+        raw_lists.append(list(dict.fromkeys(vals)))
+    # reject before the gacha expansion: expand_gacha_name_base keeps every original name,
+    # so each expanded G list contains all distinct raw values and this never exceeds the real count
+    total = math.prod(map(len, raw_lists))
+    if total <= MAX_COMBINATIONS:
+        lists = [expand_gacha_values(vals) if t.upper() == "G" else vals for t, vals in zip(tags, raw_lists)]
+        total = math.prod(map(len, lists))
+    if total > MAX_COMBINATIONS:
+        raise ValueError(f"Jumlah Kombinasi ({total}) Terlalu Banyak. Kurangi Jumlah Huruf/Angka Di Tag.")
+    # percent-encode the literal parts of the template once (spaces, braces, non-ASCII...),
+    # keeping reserved chars, [TAG] brackets and existing %XX escapes. Every url is then
+    # fully encoded: httpx would otherwise re-encode the whole path, turning %20 into %2520.
+    encoded = quote(template, safe=_TEMPLATE_SAFE)
+    # precompile template once into a format string with positional slots ([V] -> {0}, ...);
+    # positional because tag names may be digits ([7]) which format_map can't key on.
+    # No brace escaping needed: quote() already encoded any { } in the template.
+    fmt = _tag_re.sub(lambda m: "{%d}" % tags.index(m.group(1)), encoded)
+    # URL-encode each value once, not once per combination
+    quoted_lists = [[_quote_value(str(v)) for v in l] for l in lists]
+    return total, _iter_urls(fmt, quoted_lists)
+
+def _iter_urls(fmt, quoted_lists):
+    """
+    Lazily yield every url of the cartesian product (see generate_urls_from_template).
+    Skips urls already yielded: adjacent tags can collide, e.g. [G]_[E] with "a_b"+"c" and "a"+"b_c".
+    """
+    seen = set()
+    for combo in itertools.product(*quoted_lists):
+        url = fmt.format(*combo)
+        if url in seen:
+            continue
+        seen.add(url)
+        yield url
 
 # =========================
 # Conversation: ask tags then check
@@ -358,9 +406,6 @@ async def handle_tag_input(update: Update, context):
         if not tags:
             await update.message.reply_text("Template Link Tidak Valid, Tidak Ada Tag Seperti [A] Atau [2]. Kirim Ulang Template Link.")
             return ASKING_TAGS
-        if not valid_tags(tags):
-            await update.message.reply_text("Tag Hanya Boleh Huruf/Angka. Ganti Tag Dan Kirim Ulang.")
-            return ASKING_TAGS
         context.user_data['expecting_template'] = False
         context.user_data['template'] = template
         context.user_data['tags'] = tags
@@ -397,8 +442,9 @@ async def handle_tag_input(update: Update, context):
     template_marker = context.user_data.get('template')
     tag_values = context.user_data.get('values', {})
 
-    # Build urls list according to template marker
+    # Build urls according to template marker
     urls = []
+    total = 0
     try:
         if template_marker == "BANNER":
             # need to produce both splash and overview variants,
@@ -411,20 +457,19 @@ async def handle_tag_input(update: Update, context):
             overview_template = TEMPLATE_BANNER_OVERVIEW
 
             # For splash: generate urls for each combination
-            splash_urls = generate_urls_from_template(splash_template, tag_values)
+            splash_total, splash_urls = generate_urls_from_template(splash_template, tag_values)
             # For overview: generate for each variant name replacement of "overview" token in URL
             # We'll generate overview urls by replacing '/overview.jpg' with '/{variant}.jpg' after generation
-            ov_urls = []
-            base_ov_urls = generate_urls_from_template(overview_template, tag_values)
-            for base in base_ov_urls:
-                for v in OVERVIEW_VARIANTS:
-                    ov_urls.append(base.replace("/overview.jpg", f"/{v}.jpg"))
-            urls = splash_urls + ov_urls
+            ov_total, base_ov_urls = generate_urls_from_template(overview_template, tag_values)
+            ov_urls = (base.replace("/overview.jpg", f"/{v}.jpg") for base in base_ov_urls for v in OVERVIEW_VARIANTS)
+            # lazy chain: overview urls are only built once every splash url has been queued
+            urls = itertools.chain(splash_urls, ov_urls)
+            total = splash_total + ov_total * len(OVERVIEW_VARIANTS)
 
         else:
             # normal template (GACHA or CUSTOM)
             template = context.user_data.get('template')
-            urls = generate_urls_from_template(template, tag_values)
+            total, urls = generate_urls_from_template(template, tag_values)
 
     except ValueError as e:
         await update.message.reply_text(str(e))
@@ -434,67 +479,26 @@ async def handle_tag_input(update: Update, context):
         return ConversationHandler.END
 
     # safety: if nothing generated
-    if not urls:
+    if not total:
         await update.message.reply_text("Tidak Ada Link Yang Di Generate. Pastikan Semua Kolom Terisi.")
         return ConversationHandler.END
 
     # Inform user total count
-    total = len(urls)
     await update.message.reply_text(f"Total Link Yang Di Generate: {total}. Memulai Pengecekan😈...")
 
     # start checking and show progress via a dedicated message
-    progress_msg = await update.message.reply_text("Progress: [░░░░░░░░░░░░░░░] 0% (0/{})".format(total))
+    progress_msg = await update.message.reply_text(progress_text(0, total))
 
-    found = await find_first_live_url(urls, progress_msg)
+    client = get_http_client(context.application)
+    found = await find_first_live_url(client, urls, total, progress_msg)
 
     if not found:
-        # edit final message already handled in worker; ensure final text
+        # ensure final text
         await progress_msg.edit_text("❌ Aowkwok Gada Jir😂")
-    # else (found) already edited by worker to the success message
+    # else (found) already edited by find_first_live_url to the success message
 
     return ConversationHandler.END
 
-# =========================
-# Helper: generate URLs (cartesian)
-# =========================
-def generate_urls_from_template(template: str, tag_values: dict):
-    """
-    Thin wrapper that uses generate_urls_from_template defined above
-    (here we want to detect G tag expansion etc).
-    """
-    # reuse function defined earlier in module (avoid name collision)
-    # We will call the internal generator implemented above.
-    # Already defined: generate_urls_from_template (same name) -> so just call it.
-    # But to avoid recursion mistake, we call the lower-level generator function implemented earlier:
-    return __generate_urls_from_template_impl(template, tag_values)
-
-def __generate_urls_from_template_impl(template: str, tag_values: dict):
-    # same logic as previously defined generate_urls_from_template
-    tags = extract_tags(template)
-    if not tags:
-        return []
-    lists = []
-    for t in tags:
-        vals = tag_values.get(t, [])
-        if not vals:
-            return []
-        if t.upper() == "G":
-            lists.append(expand_gacha_values(vals))
-        else:
-            lists.append(vals)
-    total = 1
-    for l in lists:
-        total *= len(l)
-        if total > MAX_COMBINATIONS:
-            raise ValueError(f"Jumlah Kombinasi ({total}) Terlalu Banyak. Kurangi Jumlah Huruf/Angka Di Tag.")
-    urls = []
-    for combo in itertools.product(*lists):
-        u = template
-        for i, t in enumerate(tags):
-            u = u.replace(f'[{t}]', quote(str(combo[i]), safe=''))
-        urls.append(u)
-    return urls
-
 # =========================
 # Register handlers helper
 # =========================
@@ -523,3 +527,5 @@ def register_handlers(application):
     application.add_handler(conv)
     # also direct callback handler for the buttons (so option_button_callback catches them)
     application.add_handler(CallbackQueryHandler(option_button_callback, pattern="^link_"))
+    # close shared http client on shutdown
+    application.post_shutdown = close_http_client